@@ -0,0 +1,42 @@
+# core/management/commands/backfill_user_profiles.py
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth import get_user_model
+
+from core.redis_utils import USER_PROFILES_KEY, leaderboard_manager, check_redis_connection
+
+CustomUser = get_user_model()
+
+
+class Command(BaseCommand):
+    """
+    Populates the Redis profiles hash (user_id -> username/first_name) from the
+    database. Run once after deploying, or whenever the hash was flushed.
+    """
+    help = "Backfill the Redis user profiles hash used by the leaderboard."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help="Number of users written to Redis per HSET.",
+        )
+
+    def handle(self, *args, **options):
+        if not check_redis_connection():
+            raise CommandError("Redis is not connected.")
+
+        batch_size = options['batch_size']
+        users = CustomUser.objects.only('id', 'username', 'first_name').iterator(chunk_size=batch_size)
+
+        total = 0
+        profiles = {}
+        for user in users:
+            profiles[str(user.id)] = (user.username, user.first_name)
+            total += 1
+            if len(profiles) >= batch_size:
+                leaderboard_manager.set_user_profiles(profiles)
+                profiles = {}
+        leaderboard_manager.set_user_profiles(profiles)
+
+        self.stdout.write(self.style.SUCCESS(f"Backfilled {total} user profiles into '{USER_PROFILES_KEY}'."))
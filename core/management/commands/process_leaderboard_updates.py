@@ -0,0 +1,69 @@
+# core/management/commands/process_leaderboard_updates.py
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.redis_utils import (
+    leaderboard_manager,
+    UPDATE_QUEUE_KEY,
+    REDIS_UNAVAILABLE_ERRORS,
+    check_redis_connection,
+)
+
+
+class Command(BaseCommand):
+    """
+    Worker that applies queued score increments to the Redis leaderboards.
+    Only needed when settings.LEADERBOARD_ASYNC_UPDATES is enabled.
+
+    Increments are claimed onto a processing list and only removed from it in the same
+    MULTI/EXEC that applies them. Whatever a crashed or disconnected run left there is
+    put back on the queue when the worker (re)starts. Run a single worker at a time.
+    """
+    help = "Consume the leaderboard update queue and apply the increments to Redis (single worker)."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help="Maximum number of queued increments applied per transaction.",
+        )
+        parser.add_argument(
+            '--timeout',
+            type=int,
+            default=5,
+            help="Seconds to block waiting for new updates before polling again.",
+        )
+
+    def handle(self, *args, **options):
+        if not check_redis_connection():
+            raise CommandError("Redis is not connected.")
+
+        self.stdout.write(f"Processing leaderboard updates from '{UPDATE_QUEUE_KEY}' (Ctrl+C to stop)...")
+        needs_recovery = True
+        try:
+            while True:
+                try:
+                    if needs_recovery:
+                        moved = leaderboard_manager.requeue_unfinished_score_updates(
+                            batch_size=options['batch_size'],
+                        )
+                        if moved:
+                            self.stdout.write(f"Requeued {moved} unfinished updates.")
+                        needs_recovery = False
+
+                    items = leaderboard_manager.claim_score_updates(
+                        timeout=options['timeout'],
+                        batch_size=options['batch_size'],
+                    )
+                    if items:
+                        leaderboard_manager.apply_claimed_score_updates(items)
+                except REDIS_UNAVAILABLE_ERRORS as e:
+                    # The claimed batch is still on the processing list; it is requeued
+                    # once Redis is reachable again
+                    self.stderr.write(f"Redis unavailable, retrying in {options['timeout']}s: {e}")
+                    needs_recovery = True
+                    time.sleep(options['timeout'])
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.SUCCESS("Stopped."))
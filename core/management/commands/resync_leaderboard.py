@@ -0,0 +1,122 @@
+# core/management/commands/resync_leaderboard.py
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Sum, Value
+from django.db.models.functions import Coalesce
+
+from core.models import ScoreSubmission
+from core.redis_utils import LEADERBOARD_KEY, leaderboard_manager, check_redis_connection
+
+CustomUser = get_user_model()
+
+
+class Command(BaseCommand):
+    """
+    Rebuilds every user's total_score, the global Redis leaderboard and the
+    per-level 'leaderboard:{game_level}' boards from the ScoreSubmission history.
+    Global totals are computed with one Sum() annotation on the user queryset
+    (served by the (player, score) index) and level totals with one
+    values('player', 'game_level') aggregation, instead of one query per user.
+
+    The whole run holds row locks on the users (select_for_update), so score
+    submissions made meanwhile wait for it instead of being overwritten.
+    Each board is built into a temporary 'resync:{key}' key and RENAMEd over
+    the live one at the end, so readers never see a partial board and an
+    interrupted run leaves the live boards as they were.
+    Increments that were already committed but not yet applied to Redis
+    (e.g. still in the LEADERBOARD_ASYNC_UPDATES queue) can still race with
+    the swap, so run it in a maintenance window with the update queue drained.
+    """
+    help = "Recompute total scores from submissions and resync the Redis leaderboards (maintenance window only)."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help="Number of users written per database bulk_update / Redis ZADD.",
+        )
+
+    def handle(self, *args, **options):
+        if not check_redis_connection():
+            raise CommandError("Redis is not connected.")
+
+        batch_size = options['batch_size']
+
+        # Leftovers from an interrupted run must not leak into this rebuild
+        leaderboard_manager.discard_leaderboard_rebuilds()
+        try:
+            with transaction.atomic():
+                total, stale_count, levels = self._resync(batch_size)
+        except BaseException:
+            leaderboard_manager.discard_leaderboard_rebuilds()
+            raise
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Resynced {total} users into '{LEADERBOARD_KEY}' ({stale_count} stale totals fixed) "
+            f"and {len(levels)} level leaderboards."
+        ))
+
+    def _resync(self, batch_size):
+        """
+        Recomputes the totals and stages every board into its rebuild key, then swaps
+        them all in at once. Readers keep seeing the old boards until the swap.
+        """
+        # Lock every user row: new submissions (FK check) and their F() total_score
+        # increments block until the resync commits
+        list(CustomUser.objects.select_for_update().values_list('id', flat=True))
+
+        users = (
+            CustomUser.objects
+            .annotate(computed_total=Coalesce(Sum('scores__score'), Value(0)))
+            .only('id', 'total_score')
+            .iterator(chunk_size=batch_size)
+        )
+
+        total = 0
+        stale_users = []
+        scores = {}
+        for user in users:
+            if user.total_score != user.computed_total:
+                user.total_score = user.computed_total
+                stale_users.append(user)
+            total += 1
+            if not user.computed_total:
+                # Users who never submitted a score are not on the leaderboard (rank: null)
+                continue
+            scores[str(user.id)] = user.computed_total
+            if len(scores) >= batch_size:
+                leaderboard_manager.stage_user_scores(scores)
+                scores = {}
+        leaderboard_manager.stage_user_scores(scores)
+
+        CustomUser.objects.bulk_update(stale_users, ['total_score'], batch_size=batch_size)
+
+        level_totals = (
+            ScoreSubmission.objects
+            .values('player', 'game_level')
+            .annotate(total=Sum('score'))
+            .order_by('game_level')  # also clears Meta.ordering, which would break the GROUP BY
+            .iterator(chunk_size=batch_size)
+        )
+
+        levels = set()
+        current_level = None
+        scores = {}
+        for row in level_totals:
+            if not row['game_level']:
+                continue  # no level board for blank levels (the signal skips them too)
+            if row['game_level'] != current_level or len(scores) >= batch_size:
+                leaderboard_manager.stage_user_scores(scores, game_level=current_level)
+                scores = {}
+                current_level = row['game_level']
+                levels.add(current_level)
+            scores[str(row['player'])] = row['total']
+        leaderboard_manager.stage_user_scores(scores, game_level=current_level)
+
+        # Members no longer in the database (or only there through drift) are gone
+        # from the rebuilt boards; the swap replaces the live ones atomically
+        leaderboard_manager.publish_leaderboard_rebuilds(levels)
+
+        return total, len(stale_users), levels
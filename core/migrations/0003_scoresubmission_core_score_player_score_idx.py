@@ -0,0 +1,17 @@
+# Generated by Django 5.2.7 on 2026-10-15 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_remove_customuser_user_id'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='scoresubmission',
+            index=models.Index(fields=['player', 'score'], name='core_score_player_score_idx'),
+        ),
+    ]
@@ -62,6 +62,10 @@ class ScoreSubmission(models.Model):
         ordering = ['-score', 'timestamp']
         verbose_name = _("Score Submission")
         verbose_name_plural = _("Score Submissions")
+        indexes = [
+            # Covering index so per-player Sum('score') resyncs are answered from the index alone
+            models.Index(fields=['player', 'score'], name='core_score_player_score_idx'),
+        ]
 
     def __str__(self):
         return f"{self.player.username}: {self.score} ({self.game_level})"
\ No newline at end of file
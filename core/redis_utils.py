@@ -1,4 +1,7 @@
 # core/redis_utils.py
+import functools
+import json
+import logging
 import redis
 from django.conf import settings
 from django.db.models import F
@@ -6,22 +9,135 @@ from django.db.models import F
 # --- Configuration Constants ---
 # Key for the Sorted Set where the leaderboard data lives in Redis
 LEADERBOARD_KEY = 'global_leaderboard'
+# Prefix for the per-level Sorted Sets, keyed as 'leaderboard:{game_level}'
+LEVEL_LEADERBOARD_KEY_PREFIX = 'leaderboard'
+# Prefix for the temporary keys a full resync builds the leaderboards into, as
+# 'resync:{live_key}' (outside the 'leaderboard:*' pattern of the per-level boards)
+REBUILD_KEY_PREFIX = 'resync'
+# Key for the Hash mapping user_id -> JSON {"username", "first_name"} (display names)
+USER_PROFILES_KEY = 'user_profiles'
+# Display details used for leaderboard members missing from the profiles hash
+UNKNOWN_PROFILE = {'username': 'Unknown User', 'first_name': ''}
+# Key for the List used as a job queue of pending leaderboard increments
+# (only used when settings.LEADERBOARD_ASYNC_UPDATES is enabled)
+UPDATE_QUEUE_KEY = 'leaderboard_updates'
+# Key for the List holding the increments a worker has claimed but not yet applied
+UPDATE_PROCESSING_KEY = 'leaderboard_updates:processing'
+# Key and TTL (seconds) for the cached, already-serialized top-100 leaderboard JSON
+# (per-level boards are cached under 'lb:{game_level}:top100:json')
+TOP_USERS_CACHE_KEY = 'lb:top100:json'
+TOP_USERS_CACHE_TTL = 5
+
+logger = logging.getLogger(__name__)
 
 # Initialize Redis Connection
-try:
-    redis_conn = redis.Redis(
-        host=settings.REDIS_HOST,
-        port=settings.REDIS_PORT,
-        db=settings.REDIS_DB,
-        decode_responses=True # Ensure strings are returned instead of bytes
-    )
-    # Ping to check connection immediately
-    redis_conn.ping()
-    print("Successfully connected to Redis.")
-except redis.exceptions.ConnectionError as e:
-    print(f"Error connecting to Redis at {settings.REDIS_HOST}:{settings.REDIS_PORT}. Please ensure Redis server is running. Error: {e}")
-    # Set to None or a mock object if connection fails to prevent application crash
-    redis_conn = None 
+# A shared ConnectionPool lets concurrent workers/threads each check out their own
+# socket instead of serializing commands over a single connection.
+# Creating the pool does not connect, so importing this module never blocks worker boot.
+_POOL = redis.ConnectionPool(
+    host=settings.REDIS_HOST,
+    port=settings.REDIS_PORT,
+    db=settings.REDIS_DB,
+    decode_responses=True, # Ensure strings are returned instead of bytes
+    max_connections=50
+)
+redis_conn = redis.Redis(connection_pool=_POOL)
+
+
+# Lua script returning {top-N WITHSCORES, user's ZREVRANK, user's ZSCORE, HMGET of the top-N profiles}.
+# Redis runs it in a single event-loop tick, so the whole authenticated read is one network call.
+# KEYS[1] = leaderboard ZSET, KEYS[2] = profiles hash; ARGV[1] = last index (count - 1), ARGV[2] = user_id
+LEADERBOARD_BUNDLE_SCRIPT = """
+local top = redis.call('ZREVRANGE', KEYS[1], 0, ARGV[1], 'WITHSCORES')
+local ids = {}
+for i = 1, #top, 2 do
+    ids[#ids + 1] = top[i]
+end
+local profiles = {}
+if #ids > 0 then
+    profiles = redis.call('HMGET', KEYS[2], unpack(ids))
+end
+return {top, redis.call('ZREVRANK', KEYS[1], ARGV[2]), redis.call('ZSCORE', KEYS[1], ARGV[2]), profiles}
+"""
+
+
+# Lua script moving up to ARGV[1] items from the tail of list KEYS[1] to the head of
+# list KEYS[2] (RPOPLPUSH in a loop, server-side) and returning the moved items.
+# Stops early when KEYS[1] runs empty, so a short queue costs only what it holds.
+MOVE_LIST_ITEMS_SCRIPT = """
+local items = {}
+for i = 1, tonumber(ARGV[1]) do
+    local item = redis.call('RPOPLPUSH', KEYS[1], KEYS[2])
+    if not item then
+        break
+    end
+    items[#items + 1] = item
+end
+return items
+"""
+
+
+def leaderboard_key(game_level=None):
+    """
+    Returns the Sorted Set key for a game level, or the global board if no level is given.
+    """
+    if game_level:
+        return f'{LEVEL_LEADERBOARD_KEY_PREFIX}:{game_level}'
+    return LEADERBOARD_KEY
+
+
+def rebuild_key(live_key):
+    """
+    Returns the temporary key a resync builds a leaderboard into before swapping it in.
+    """
+    return f'{REBUILD_KEY_PREFIX}:{live_key}'
+
+
+def top_users_cache_key(game_level=None):
+    """
+    Returns the key caching the serialized top-100 list of a game level (or of the global board).
+    """
+    if game_level:
+        return f'lb:{game_level}:top100:json'
+    return TOP_USERS_CACHE_KEY
+
+
+# Errors meaning Redis is unreachable (server down, network issue)
+REDIS_UNAVAILABLE_ERRORS = (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError)
+
+
+def check_redis_connection():
+    """
+    Lazy health check: pings Redis and returns True if the server is reachable.
+    """
+    try:
+        redis_conn.ping()
+        return True
+    except REDIS_UNAVAILABLE_ERRORS as e:
+        logger.error(
+            "Error connecting to Redis at %s:%s. Please ensure Redis server is running. Error: %s",
+            settings.REDIS_HOST, settings.REDIS_PORT, e
+        )
+        return False
+
+
+def _fallback_if_redis_unavailable(default=lambda: None):
+    """
+    Decorator for LeaderboardManager methods on the request/save paths: if Redis is
+    unreachable, the error is logged and 'default()' is returned instead of raising,
+    so a Redis outage degrades the leaderboard instead of failing the request.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            try:
+                return method(*args, **kwargs)
+            except REDIS_UNAVAILABLE_ERRORS as e:
+                logger.error("Redis unavailable in LeaderboardManager.%s: %s", method.__name__, e)
+                return default()
+        return wrapper
+    return decorator
+
 
 class LeaderboardManager:
     """
@@ -32,75 +148,290 @@ class LeaderboardManager:
 
     def __init__(self):
         self.r = redis_conn
-        if not self.r:
-            # Raise an error or log a warning if Redis is not connected
-            # For this tutorial, we will rely on the print above.
-            pass
+        # register_script() does not contact Redis; the script is loaded on first use
+        # and then invoked via EVALSHA
+        self._bundle_script = self.r.register_script(LEADERBOARD_BUNDLE_SCRIPT)
+        self._move_items_script = self.r.register_script(MOVE_LIST_ITEMS_SCRIPT)
 
-    def update_user_score(self, user_id: str, new_total_score: int):
+    def stage_user_scores(self, scores: dict, game_level: str = None):
         """
-        Updates a user's score in the Redis leaderboard.
-        The score is the total_score, and the member is the user's ID.
-        
+        Writes a {user_id: total_score} mapping, with a single ZADD, into the rebuild key
+        of a leaderboard ('game_level' board if given, otherwise the global one).
+        The live board is untouched until publish_leaderboard_rebuilds() swaps it in.
+
         Note: In Redis ZSETs, higher scores are better by default.
+        Only meant for full resyncs (see the resync_leaderboard command); regular
+        submissions go through increment_user_scores().
+        """
+        if scores:
+            self.r.zadd(rebuild_key(leaderboard_key(game_level)), scores)
+
+    def publish_leaderboard_rebuilds(self, game_levels):
+        """
+        Atomically (MULTI/EXEC) replaces the live boards with the staged rebuilds:
+        each rebuild key is RENAMEd over its live key, and live boards that got no
+        rebuilt data (an empty global board, levels without submissions) are deleted.
+        """
+        live_keys = [LEADERBOARD_KEY] + [leaderboard_key(game_level) for game_level in game_levels]
+        stale_level_keys = [
+            key for key in self.r.scan_iter(match=f'{LEVEL_LEADERBOARD_KEY_PREFIX}:*')
+            if key not in live_keys
+        ]
+        staged = {key for key in live_keys if self.r.exists(rebuild_key(key))}
+
+        pipe = self.r.pipeline(transaction=True)
+        for key in live_keys:
+            if key in staged:
+                pipe.rename(rebuild_key(key), key)
+            else:
+                pipe.delete(key)
+        if stale_level_keys:
+            pipe.delete(*stale_level_keys)
+        pipe.execute()
+
+    def discard_leaderboard_rebuilds(self):
+        """
+        Deletes every staged rebuild key (e.g. left over by an interrupted resync).
+        """
+        keys = list(self.r.scan_iter(match=f'{REBUILD_KEY_PREFIX}:*'))
+        if keys:
+            self.r.delete(*keys)
+
+    @staticmethod
+    def _queue_increments(pipe, deltas: dict):
+        """
+        Queues the ZINCRBYs for a batch of {(game_level, user_id): delta} increments on
+        'pipe': one on the global leaderboard and, if a level is given, one on that level's.
+        """
+        key = LEADERBOARD_KEY
+        zincrby = pipe.zincrby
+        for (game_level, user_id), delta in deltas.items():
+            zincrby(key, delta, user_id)
+            if game_level:
+                zincrby(leaderboard_key(game_level), delta, user_id)
+
+    @_fallback_if_redis_unavailable()
+    def increment_user_scores(self, deltas: dict):
+        """
+        Applies a batch of {(game_level, user_id): delta} increments to the global
+        leaderboard and to each level's leaderboard.
+        All ZINCRBYs are sent on one non-transactional pipeline (a single round-trip).
+        """
+        if deltas:
+            pipe = self.r.pipeline(transaction=False)
+            self._queue_increments(pipe, deltas)
+            pipe.execute()
+
+    @_fallback_if_redis_unavailable()
+    def enqueue_score_updates(self, deltas: dict):
+        """
+        Pushes a batch of {(game_level, user_id): delta} increments onto the update
+        queue with a single LPUSH, for the worker to apply later.
         """
-        if self.r:
-            # ZADD adds the member (user_id) with the score (new_total_score)
-            # If the member exists, the score is updated.
-            self.r.zadd(LEADERBOARD_KEY, {user_id: new_total_score})
+        if deltas:
+            self.r.lpush(UPDATE_QUEUE_KEY, *[
+                json.dumps([game_level, user_id, delta])
+                for (game_level, user_id), delta in deltas.items()
+            ])
 
-    def get_top_users(self, count: int = 100):
+    def claim_score_updates(self, timeout: int = 5, batch_size: int = 500):
         """
-        Retrieves the top 'count' users from the leaderboard, including their rank and score.
+        Blocks up to 'timeout' seconds for queued increments, then moves up to 'batch_size'
+        of them onto the processing list and returns them (raw queue items).
+        Claimed items stay on the processing list until apply_claimed_score_updates()
+        succeeds, so a worker crash or Redis error never loses them.
+        BRPOPLPUSH/RPOPLPUSH are used rather than RPOP with a count, which needs Redis 6.2+.
+        """
+        first = self.r.brpoplpush(UPDATE_QUEUE_KEY, UPDATE_PROCESSING_KEY, timeout=timeout)
+        if first is None:
+            return []
+        if batch_size <= 1:
+            return [first]
+        # Claim the rest of the batch (only what is actually queued) in one round-trip
+        return [first] + self._move_items_script(
+            keys=[UPDATE_QUEUE_KEY, UPDATE_PROCESSING_KEY], args=[batch_size - 1]
+        )
+
+    def apply_claimed_score_updates(self, items: list):
+        """
+        Applies claimed queue items to the leaderboards and clears the processing list
+        in one MULTI/EXEC, so they are either applied and acknowledged together or not at all.
+        A single DEL acknowledges the whole batch: with one worker (see the
+        process_leaderboard_updates command) the processing list holds exactly 'items'.
+        """
+        deltas = {}
+        for item in items:
+            game_level, user_id, delta = json.loads(item)
+            deltas[(game_level, user_id)] = deltas.get((game_level, user_id), 0) + delta
+
+        pipe = self.r.pipeline(transaction=True)
+        self._queue_increments(pipe, deltas)
+        pipe.delete(UPDATE_PROCESSING_KEY)
+        pipe.execute()
+
+    def requeue_unfinished_score_updates(self, batch_size: int = 500):
+        """
+        Moves the items left on the processing list (by a worker that crashed or lost its
+        Redis connection mid-batch) back onto the update queue, 'batch_size' per round-trip.
+        Returns how many were moved. Only safe while no other worker is running.
+        """
+        moved = 0
+        while True:
+            items = self._move_items_script(
+                keys=[UPDATE_PROCESSING_KEY, UPDATE_QUEUE_KEY], args=[batch_size]
+            )
+            moved += len(items)
+            if len(items) < batch_size:
+                return moved
+
+    @staticmethod
+    def encode_profile(username: str, first_name: str):
+        """
+        Serializes a user's display details into the JSON stored in the profiles hash.
+        """
+        return json.dumps({'username': username, 'first_name': first_name})
+
+    @_fallback_if_redis_unavailable()
+    def set_user_profile(self, user_id: str, username: str, first_name: str):
+        """
+        Stores a user's display details in the Redis profiles hash so that
+        leaderboard reads never need to hit the database for names.
+        """
+        self.r.hset(USER_PROFILES_KEY, user_id, self.encode_profile(username, first_name))
+
+    def set_user_profiles(self, profiles: dict):
+        """
+        Stores many users' display details at once from a {user_id: (username, first_name)}
+        mapping, with a single HSET. Used by the backfill_user_profiles command.
+        """
+        if profiles:
+            self.r.hset(USER_PROFILES_KEY, mapping={
+                user_id: self.encode_profile(username, first_name)
+                for user_id, (username, first_name) in profiles.items()
+            })
+
+    @_fallback_if_redis_unavailable()
+    def delete_user_profile(self, user_id: str):
+        """
+        Removes a user's display details from the Redis profiles hash.
+        """
+        self.r.hdel(USER_PROFILES_KEY, user_id)
+
+    def _get_profiles(self, top_scores_data):
+        """
+        Fetches the display details for every member of a ZREVRANGE result
+        with a single HMGET. Returns a list aligned with top_scores_data.
+        """
+        if not top_scores_data:
+            return []
+        return self.r.hmget(USER_PROFILES_KEY, [user_id for user_id, _ in top_scores_data])
+
+    @_fallback_if_redis_unavailable()
+    def get_cached_top_users_json(self, game_level: str = None):
+        """
+        Returns the cached top-100 leaderboard as a JSON string, or None on a cache miss.
+        """
+        return self.r.get(top_users_cache_key(game_level))
+
+    @_fallback_if_redis_unavailable()
+    def cache_top_users_json(self, leaderboard_json: bytes, game_level: str = None):
+        """
+        Caches the serialized top-100 leaderboard. The short TTL bounds staleness
+        after new score submissions without needing explicit invalidation.
+        """
+        self.r.setex(top_users_cache_key(game_level), TOP_USERS_CACHE_TTL, leaderboard_json)
+
+    @staticmethod
+    def _format_top_users(top_scores_data, profiles):
+        """
+        Converts the (user_id, score) tuples returned by ZREVRANGE into a list of dicts,
+        merged with the matching HMGET profile entries.
+        """
+        # Local bindings avoid repeated global/builtin lookups inside the comprehension
+        _int = int
+        _loads = json.loads
+        # Single pass: each profile is decoded while its entry is built.
+        # Redis stores scores as floats, convert back to int for scores
+        return [
+            {
+                'rank': rank,
+                'user_id': user_id,
+                'score': _int(score),
+                **(_loads(profile) if profile else UNKNOWN_PROFILE),
+            }
+            for rank, ((user_id, score), profile) in enumerate(zip(top_scores_data, profiles), start=1)
+        ]
+
+    @staticmethod
+    def _format_rank(rank_index, score):
+        """
+        Converts a raw ZREVRANK/ZSCORE pair into the {'rank', 'score'} dict.
+        """
+        if rank_index is not None:
+            # Add 1 to get the human-readable rank
+            return {
+                'rank': rank_index + 1,
+                'score': int(score) if score is not None else 0
+            }
+        return {'rank': None, 'score': 0}
+
+    @_fallback_if_redis_unavailable(default=list)
+    def get_top_users(self, count: int = 100, game_level: str = None):
+        """
+        Retrieves the top 'count' users from the leaderboard, including their rank, score
+        and display details (username, first_name) from the profiles hash.
         Uses ZREVRANGE to get elements from highest score to lowest score (reverse order).
+        Reads the 'game_level' board if given, otherwise the global one.
         """
 
         end_index = count - 1  # Redis uses 0-based indexing
         
-        if self.r:
-            # ZREVRANGEBYSCORE: returns (member, score) pairs
-            # REV: means highest scores first (descending)
-            # WITHSCORS: includes the score with the member (user_id)
-            top_scores_data = self.r.zrevrange(
-                LEADERBOARD_KEY, 
-                0, 
-                end_index, 
-                withscores=True
-            )
-            
-            # Convert the list of (user_id, score) tuples into a list of dicts
-            leaderboard_data = []
-            for rank, (user_id, score) in enumerate(top_scores_data, start=1):
-                leaderboard_data.append({
-                    'rank': rank,
-                    'user_id': user_id,
-                    # Redis stores scores as floats, convert back to int for scores
-                    'score': int(score) 
-                })
-            return leaderboard_data
-        return []
-
-    def get_user_rank_and_score(self, user_id: str):
+        # ZREVRANGEBYSCORE: returns (member, score) pairs
+        # REV: means highest scores first (descending)
+        # WITHSCORS: includes the score with the member (user_id)
+        top_scores_data = self.r.zrevrange(
+            leaderboard_key(game_level), 
+            0, 
+            end_index, 
+            withscores=True
+        )
+        return self._format_top_users(top_scores_data, self._get_profiles(top_scores_data))
+
+    @_fallback_if_redis_unavailable(default=lambda: {'rank': None, 'score': 0})
+    def get_user_rank_and_score(self, user_id: str, game_level: str = None):
         """
         Retrieves a user's rank and score.
         ZREVRANK returns the rank (0-indexed, highest score first).
+        Both lookups are pipelined into one round-trip.
         """
-        if self.r:
-            # ZREVRANK: Gets the 0-indexed rank (higher score = lower rank index)
-            rank_index = self.r.zrevrank(LEADERBOARD_KEY, user_id)
-            
-            if rank_index is not None:
-                # Add 1 to get the human-readable rank
-                rank = rank_index + 1
-                
-                # ZSCORE: Gets the score associated with the member
-                score = self.r.zscore(LEADERBOARD_KEY, user_id)
-                
-                return {
-                    'rank': rank,
-                    'score': int(score) if score is not None else 0
-                }
-        return {'rank': None, 'score': 0}
+        key = leaderboard_key(game_level)
+        # ZREVRANK + ZSCORE are queued on a non-transactional pipeline so
+        # both answers come back in a single network round-trip
+        pipe = self.r.pipeline(transaction=False)
+        pipe.zrevrank(key, user_id)  # 0-indexed rank (higher score = lower rank index)
+        pipe.zscore(key, user_id)    # score associated with the member
+        rank_index, score = pipe.execute()
+        return self._format_rank(rank_index, score)
+
+    @_fallback_if_redis_unavailable(default=lambda: ([], {'rank': None, 'score': 0}))
+    def get_leaderboard_bundle(self, user_id: str, count: int = 100, game_level: str = None):
+        """
+        Retrieves the top 'count' users (with their display details) AND the given
+        user's rank/score in a single network call, using LEADERBOARD_BUNDLE_SCRIPT.
+        Returns a (top_users, user_rank) tuple shaped like get_top_users() and
+        get_user_rank_and_score().
+        """
+        top_flat, rank_index, score, profiles = self._bundle_script(
+            keys=[leaderboard_key(game_level), USER_PROFILES_KEY],
+            args=[count - 1, user_id]
+        )
+        # Lua returns WITHSCORES as a flat [member, score, ...] list of strings.
+        # Both zip() arguments consume the same iterator, so it yields lazy
+        # (member, float(score)) pairs without building an intermediate list.
+        flat = iter(top_flat)
+        top_scores_data = zip(flat, map(float, flat))
+        top_users = self._format_top_users(top_scores_data, profiles)
+        return top_users, self._format_rank(rank_index, float(score) if score is not None else None)
 
 # Instantiate the manager for use in signals and views
 leaderboard_manager = LeaderboardManager()
\ No newline at end of file
@@ -14,7 +14,8 @@ class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
         # Add custom claims
         token['username'] = user.username
         token['first_name'] = user.first_name
-        token['total_score'] = user.total_score
+        # total_score is intentionally not a claim: it goes stale on the next submission.
+        # Clients read the live score from /leaderboard/ (current_user_rank).
         
         
         return token
@@ -1,21 +1,84 @@
 # core/signals.py
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from django.db.models import Sum
+from django.db import transaction
+from django.conf import settings
+from django.db.models import F
 from .models import ScoreSubmission, CustomUser
 from .redis_utils import leaderboard_manager
 from redis.exceptions import ConnectionError as RedisConnectionError # Add this import if using a standard Redis library
 
+import logging
 import threading
+import weakref
+from functools import partial
 
-# Thread Local Storage (TLS) to prevent signal loops
+logger = logging.getLogger(__name__)
+
+# Thread Local Storage (TLS) holding the Redis increments queued on this thread
 _thread_local = threading.local()
 
+
+class _PendingIncrement:
+    """
+    One queued leaderboard increment. Its only strong reference is the on_commit hook
+    registered for it, so when Django discards the hook (the transaction or savepoint it
+    was queued in rolled back), the increment is freed and drops out of the pending WeakSet.
+    """
+    __slots__ = ('key', 'delta', '__weakref__')
+
+    def __init__(self, key, delta):
+        self.key = key
+        self.delta = delta
+
+
+def _pending_increments():
+    pending = getattr(_thread_local, 'pending_increments', None)
+    if pending is None:
+        pending = _thread_local.pending_increments = weakref.WeakSet()
+    return pending
+
+
+def flush_leaderboard_batch(increment):
+    """
+    on_commit hook, registered once per queued increment. The first hook that runs after
+    a commit sends every increment still pending to Redis in a single round-trip; the
+    following hooks find theirs already sent. Rolled-back increments are never pending here.
+    With LEADERBOARD_ASYNC_UPDATES they are only pushed onto the update queue,
+    and the process_leaderboard_updates worker applies them.
+    """
+    pending = _pending_increments()
+    if increment not in pending:
+        return
+
+    deltas = {}
+    for item in list(pending):
+        deltas[item.key] = deltas.get(item.key, 0) + item.delta
+    pending.clear()
+
+    if getattr(settings, 'LEADERBOARD_ASYNC_UPDATES', False):
+        leaderboard_manager.enqueue_score_updates(deltas)
+    else:
+        leaderboard_manager.increment_user_scores(deltas)
+
+
+def queue_leaderboard_increment(user_id: str, delta: int, game_level: str = None):
+    """
+    Queues a Redis leaderboard increment (global board, plus the 'game_level' board
+    if given) to be flushed once the current transaction commits.
+    Outside of an atomic block the hook runs immediately, so this behaves like a direct write.
+    """
+    increment = _PendingIncrement((game_level, user_id), delta)
+    # Added before registering the hook, since on_commit fires right away in autocommit mode
+    _pending_increments().add(increment)
+    transaction.on_commit(partial(flush_leaderboard_batch, increment), robust=True)
+
+
 @receiver(post_save, sender=ScoreSubmission)
 def update_leaderboard_on_submission(sender, instance, created, **kwargs):
     """
     Signal handler that runs AFTER a ScoreSubmission is saved.
-    It recalculates the user's total score and updates Redis.
+    It increments the user's total score and updates Redis.
     """
     if not created:
         # We only care about NEW submissions to avoid processing updates/deletes
@@ -24,34 +87,39 @@ def update_leaderboard_on_submission(sender, instance, created, **kwargs):
     # 1. Get the user (player) associated with the new score submission
     player = instance.player
     
-    # Check for re-entrancy (signal loop) on the same thread
-    if getattr(_thread_local, 'processing_leaderboard', False):
+    # 2. Increment the user's total score by the newly submitted score (Atomic Operation)
+    # F('total_score') makes the database do the addition, so we avoid re-aggregating
+    # the player's whole submission history on every new score.
+    # update() bypasses CustomUser.save(), so no signal fires and this handler cannot re-enter.
+    CustomUser.objects.filter(pk=player.pk).update(total_score=F('total_score') + instance.score)
+
+    # 3. Queue the same increment for the global and per-level Redis Leaderboards (ZINCRBY)
+    # Bursts of submissions in one transaction are flushed together after commit
+    user_id_str = str(player.id)
+    queue_leaderboard_increment(user_id_str, instance.score, instance.game_level)
+    logger.debug("Leaderboard increment queued: user %s scored %s", user_id_str, instance.score)
+
+
+@receiver(post_save, sender=CustomUser)
+def sync_user_profile(sender, instance, created, update_fields=None, **kwargs):
+    """
+    Signal handler that mirrors a user's display details (username, first_name)
+    into the Redis profiles hash, so leaderboard reads don't need the database.
+    The write waits for the transaction to commit, so a rolled-back save never reaches Redis.
+    """
+    # Saves that don't touch the display fields (e.g. last_login on login) are skipped
+    if update_fields is not None and not {'username', 'first_name'} & set(update_fields):
         return
-    
-    try:
-        _thread_local.processing_leaderboard = True
-        
-        # 2. Recalculate the user's total score from the database (Atomic Operation)
-        # Note: F('score') is often used with update() for atomic operations, 
-        # but here we need the Sum() of all scores, so an aggregate query is best.
-        
-        # Calculate the sum of ALL scores for this player
-        score_aggregation = ScoreSubmission.objects.filter(player=player).aggregate(total=Sum('score'))
-        new_total_score = score_aggregation['total'] if score_aggregation['total'] is not None else 0
-
-        # 3. Update the CustomUser model's total_score field (Atomicity is critical)
-        # We update the field on the database directly to avoid triggering the save() method 
-        # of the CustomUser model, which could cause an infinite signal loop if we had a 
-        # post_save on CustomUser.
-        CustomUser.objects.filter(pk=player.pk).update(total_score=new_total_score)
-        
-        # 4. Update the Redis Leaderboard
-        user_id_str = str(player.id)
-        leaderboard_manager.update_user_score(user_id_str, new_total_score)
-        
-        print(f"Leaderboard updated: User {player.username} total score is now {new_total_score}")
-        
-    finally:
-        # Ensure the lock is released
-        if hasattr(_thread_local, 'processing_leaderboard'):
-            del _thread_local.processing_leaderboard
\ No newline at end of file
+
+    transaction.on_commit(partial(
+        leaderboard_manager.set_user_profile, str(instance.id), instance.username, instance.first_name
+    ), robust=True)
+
+
+@receiver(post_delete, sender=CustomUser)
+def remove_user_profile(sender, instance, **kwargs):
+    """
+    Signal handler that drops a deleted user's display details from Redis,
+    once the delete has committed.
+    """
+    transaction.on_commit(partial(leaderboard_manager.delete_user_profile, str(instance.id)), robust=True)
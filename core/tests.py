@@ -1,3 +1,264 @@
-from django.test import TestCase
+import json
+from unittest import mock
 
-# Create your tests here.
+from django.db import transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.urls import reverse
+from redis.exceptions import ConnectionError as RedisConnectionError
+from rest_framework.test import APIClient
+
+from . import redis_utils
+from .models import CustomUser, ScoreSubmission
+from .redis_utils import LeaderboardManager, leaderboard_manager
+
+
+class LeaderboardBatchingTests(TransactionTestCase):
+    """
+    Score submissions queue their Redis increments until the transaction commits.
+    TransactionTestCase is used so that on_commit hooks really run (or get discarded).
+    """
+
+    def setUp(self):
+        # Keep Redis out of the tests: record what would be sent instead
+        for name in ('increment_user_scores', 'set_user_profile'):
+            patcher = mock.patch.object(leaderboard_manager, name)
+            setattr(self, name, patcher.start())
+            self.addCleanup(patcher.stop)
+
+        self.alice = CustomUser.objects.create_user(username='alice', email='alice@example.com', password='pw')
+        self.bob = CustomUser.objects.create_user(username='bob', email='bob@example.com', password='pw')
+
+    def sent_batches(self):
+        return [call.args[0] for call in self.increment_user_scores.call_args_list]
+
+    def test_autocommit_submission_is_sent_immediately(self):
+        ScoreSubmission.objects.create(player=self.alice, score=7)
+
+        self.assertEqual(self.sent_batches(), [{('default_game', str(self.alice.id)): 7}])
+
+    def test_transaction_is_sent_as_one_batch(self):
+        with transaction.atomic():
+            ScoreSubmission.objects.create(player=self.alice, score=5)
+            ScoreSubmission.objects.create(player=self.alice, score=10, game_level='level_1')
+            ScoreSubmission.objects.create(player=self.bob, score=3)
+            self.assertEqual(self.sent_batches(), [])
+
+        self.assertEqual(self.sent_batches(), [{
+            ('default_game', str(self.alice.id)): 5,
+            ('level_1', str(self.alice.id)): 10,
+            ('default_game', str(self.bob.id)): 3,
+        }])
+
+    def test_rolled_back_savepoint_increments_are_not_sent(self):
+        with transaction.atomic():
+            ScoreSubmission.objects.create(player=self.alice, score=5)
+            ScoreSubmission.objects.create(player=self.alice, score=10)
+            with self.assertRaises(RuntimeError):
+                with transaction.atomic():
+                    ScoreSubmission.objects.create(player=self.bob, score=100)
+                    raise RuntimeError("rolled back")
+
+        self.assertEqual(self.sent_batches(), [{('default_game', str(self.alice.id)): 15}])
+
+        self.alice.refresh_from_db()
+        self.bob.refresh_from_db()
+        self.assertEqual((self.alice.total_score, self.bob.total_score), (15, 0))
+
+    def test_rolled_back_transaction_increments_are_not_sent_later(self):
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                ScoreSubmission.objects.create(player=self.bob, score=100)
+                raise RuntimeError("rolled back")
+
+        ScoreSubmission.objects.create(player=self.alice, score=5)
+
+        self.assertEqual(self.sent_batches(), [{('default_game', str(self.alice.id)): 5}])
+
+
+class RealTimeLeaderboardViewTests(TestCase):
+    """
+    The leaderboard view, with Redis replaced by mocks: the raw replies of the Lua
+    bundle script, the ZREVRANGE/HMGET reads and the cached top-100 JSON.
+    """
+
+    def setUp(self):
+        self.r = mock.MagicMock()
+        for name, value in (
+            ('r', self.r),
+            ('_bundle_script', mock.MagicMock()),
+            ('get_cached_top_users_json', mock.MagicMock(return_value=None)),
+            ('cache_top_users_json', mock.MagicMock()),
+        ):
+            patcher = mock.patch.object(leaderboard_manager, name, value)
+            setattr(self, name.lstrip('_'), patcher.start())
+            self.addCleanup(patcher.stop)
+
+        self.alice = CustomUser.objects.create_user(
+            username='alice', email='alice@example.com', password='pw', first_name='Alice'
+        )
+        self.bob = CustomUser.objects.create_user(
+            username='bob', email='bob@example.com', password='pw', first_name='Bob'
+        )
+        self.alice_id, self.bob_id = str(self.alice.id), str(self.bob.id)
+        self.alice_profile = leaderboard_manager.encode_profile('alice', 'Alice')
+
+        self.client = APIClient()
+        self.url = reverse('realtime-leaderboard')
+
+    def get_json(self, user=None, **params):
+        if user is not None:
+            self.client.force_authenticate(user)
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        return json.loads(response.content)
+
+    def test_anonymous_reads_top_users_and_caches_them(self):
+        self.r.zrevrange.return_value = [(self.alice_id, 50.0), (self.bob_id, 30.0)]
+        # bob has no entry in the profiles hash
+        self.r.hmget.return_value = [self.alice_profile, None]
+
+        expected_board = [
+            {'rank': 1, 'user_id': self.alice_id, 'score': 50, 'username': 'alice', 'first_name': 'Alice'},
+            {'rank': 2, 'user_id': self.bob_id, 'score': 30, 'username': 'Unknown User', 'first_name': ''},
+        ]
+        self.assertEqual(self.get_json(), {'global_leaderboard': expected_board, 'current_user_rank': None})
+
+        self.r.zrevrange.assert_called_once_with('global_leaderboard', 0, 99, withscores=True)
+        self.r.hmget.assert_called_once_with('user_profiles', [self.alice_id, self.bob_id])
+        self.bundle_script.assert_not_called()
+        cached_json, cached_level = self.cache_top_users_json.call_args.args
+        self.assertEqual(json.loads(cached_json), expected_board)
+        self.assertIsNone(cached_level)
+
+    def test_authenticated_uses_lua_bundle(self):
+        # Lua reply: flat WITHSCORES list, ZREVRANK, ZSCORE (strings), HMGET profiles
+        self.bundle_script.return_value = [
+            [self.alice_id, '50', self.bob_id, '30'], 1, '30', [self.alice_profile, None]
+        ]
+
+        self.assertEqual(self.get_json(user=self.bob), {
+            'global_leaderboard': [
+                {'rank': 1, 'user_id': self.alice_id, 'score': 50, 'username': 'alice', 'first_name': 'Alice'},
+                {'rank': 2, 'user_id': self.bob_id, 'score': 30, 'username': 'Unknown User', 'first_name': ''},
+            ],
+            'current_user_rank': {'rank': 2, 'score': 30, 'username': 'bob', 'first_name': 'Bob'},
+        })
+        self.bundle_script.assert_called_once_with(
+            keys=['global_leaderboard', 'user_profiles'], args=[99, self.bob_id]
+        )
+        self.r.zrevrange.assert_not_called()
+
+    def test_authenticated_user_not_ranked(self):
+        # ZREVRANK/ZSCORE of a missing member come back from Lua as false -> None
+        self.bundle_script.return_value = [[self.alice_id, '50'], None, None, [self.alice_profile]]
+
+        self.assertEqual(self.get_json(user=self.bob), {
+            'global_leaderboard': [
+                {'rank': 1, 'user_id': self.alice_id, 'score': 50, 'username': 'alice', 'first_name': 'Alice'},
+            ],
+            'current_user_rank': {'rank': None, 'score': 0, 'username': 'bob', 'first_name': 'Bob'},
+        })
+
+    def test_cache_hit_anonymous(self):
+        self.get_cached_top_users_json.return_value = '[{"rank":1,"user_id":"7","score":5}]'
+
+        self.assertEqual(self.get_json(), {
+            'global_leaderboard': [{'rank': 1, 'user_id': '7', 'score': 5}],
+            'current_user_rank': None,
+        })
+        self.bundle_script.assert_not_called()
+        self.r.zrevrange.assert_not_called()
+        self.cache_top_users_json.assert_not_called()
+
+    def test_cache_hit_authenticated_only_reads_own_rank(self):
+        self.get_cached_top_users_json.return_value = '[{"rank":1,"user_id":"7","score":5}]'
+        self.r.pipeline.return_value.execute.return_value = [0, 5.0]
+
+        self.assertEqual(self.get_json(user=self.alice), {
+            'global_leaderboard': [{'rank': 1, 'user_id': '7', 'score': 5}],
+            'current_user_rank': {'rank': 1, 'score': 5, 'username': 'alice', 'first_name': 'Alice'},
+        })
+        self.bundle_script.assert_not_called()
+        self.cache_top_users_json.assert_not_called()
+
+    def test_level_param_reads_level_board(self):
+        self.bundle_script.return_value = [[self.alice_id, '50'], 0, '50', [self.alice_profile]]
+
+        self.get_json(user=self.alice, level='level_1')
+
+        self.get_cached_top_users_json.assert_called_once_with('level_1')
+        self.bundle_script.assert_called_once_with(
+            keys=['leaderboard:level_1', 'user_profiles'], args=[99, self.alice_id]
+        )
+        self.assertEqual(self.cache_top_users_json.call_args.args[1], 'level_1')
+
+    def test_empty_board_is_not_cached(self):
+        self.r.zrevrange.return_value = []
+
+        self.assertEqual(self.get_json(), {'global_leaderboard': [], 'current_user_rank': None})
+        self.cache_top_users_json.assert_not_called()
+
+
+class LeaderboardUpdateQueueTests(SimpleTestCase):
+    """
+    Claim / apply / requeue of the LEADERBOARD_ASYNC_UPDATES queue, against a mocked client.
+    """
+
+    def setUp(self):
+        self.r = mock.MagicMock()
+        with mock.patch.object(redis_utils, 'redis_conn', self.r):
+            self.manager = LeaderboardManager()
+        self.move_items_script = self.manager._move_items_script = mock.MagicMock()
+        self.pipe = self.r.pipeline.return_value
+
+    def test_claim_returns_nothing_when_queue_stays_empty(self):
+        self.r.brpoplpush.return_value = None
+
+        self.assertEqual(self.manager.claim_score_updates(timeout=3, batch_size=500), [])
+        self.r.brpoplpush.assert_called_once_with(
+            'leaderboard_updates', 'leaderboard_updates:processing', timeout=3
+        )
+        self.move_items_script.assert_not_called()
+
+    def test_claim_moves_rest_of_batch_with_one_script_call(self):
+        self.r.brpoplpush.return_value = 'first'
+        self.move_items_script.return_value = ['second', 'third']
+
+        self.assertEqual(self.manager.claim_score_updates(batch_size=500), ['first', 'second', 'third'])
+        self.move_items_script.assert_called_once_with(
+            keys=['leaderboard_updates', 'leaderboard_updates:processing'], args=[499]
+        )
+
+    def test_apply_merges_increments_and_acknowledges_batch(self):
+        items = [
+            json.dumps(['level_1', '1', 5]),
+            json.dumps(['level_1', '1', 3]),
+            json.dumps([None, '2', 4]),
+        ]
+
+        self.manager.apply_claimed_score_updates(items)
+
+        self.r.pipeline.assert_called_once_with(transaction=True)
+        self.assertEqual(self.pipe.zincrby.call_args_list, [
+            mock.call('global_leaderboard', 8, '1'),
+            mock.call('leaderboard:level_1', 8, '1'),
+            mock.call('global_leaderboard', 4, '2'),
+        ])
+        self.pipe.delete.assert_called_once_with('leaderboard_updates:processing')
+        self.pipe.lrem.assert_not_called()
+        self.pipe.execute.assert_called_once_with()
+
+    def test_apply_failure_propagates_so_items_stay_claimed(self):
+        self.pipe.execute.side_effect = RedisConnectionError("down")
+
+        with self.assertRaises(RedisConnectionError):
+            self.manager.apply_claimed_score_updates([json.dumps([None, '1', 5])])
+
+    def test_requeue_moves_processing_list_back_in_batches(self):
+        self.move_items_script.side_effect = [['a', 'b'], ['c']]
+
+        self.assertEqual(self.manager.requeue_unfinished_score_updates(batch_size=2), 3)
+        self.assertEqual(self.move_items_script.call_args_list, [
+            mock.call(keys=['leaderboard_updates:processing', 'leaderboard_updates'], args=[2]),
+        ] * 2)
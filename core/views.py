@@ -1,10 +1,10 @@
 # core/views.py
-from rest_framework import generics, permissions, status
-from rest_framework.response import Response
+import orjson
+from django.http import HttpResponse
+from rest_framework import generics, permissions
 from rest_framework.views import APIView
-from django.db.models import F
 from django.contrib.auth import get_user_model # Use this for CustomUser
-from drf_spectacular.utils import extend_schema, OpenApiExample, inline_serializer
+from drf_spectacular.utils import extend_schema, OpenApiExample, OpenApiParameter, inline_serializer
 from rest_framework import serializers # Needed for inline_serializer
 
 # Get the configured custom user model
@@ -31,6 +31,14 @@ class ScoreSubmissionCreateView(generics.CreateAPIView):
 
 
 @extend_schema(
+    parameters=[
+        OpenApiParameter(
+            name='level',
+            type=str,
+            required=False,
+            description="Game/level identifier. If given, the leaderboard of that level is returned instead of the global one.",
+        ),
+    ],
     # Use the decorator to clearly define the response structure for documentation
     responses={
         200: inline_serializer(
@@ -72,56 +80,57 @@ class RealTimeLeaderboardView(APIView):
     The response contains the top 100 users (`global_leaderboard`) and, 
     if the request is authenticated, the current user's specific rank and score 
     (`current_user_rank`).
+    Pass `?level=<game_level>` to read that level's leaderboard instead.
     """
     permission_classes = [permissions.AllowAny] # <-- Set to AllowAny for public access
 
     def get(self, request, format=None):
-        # 1. Get Top 100 Leaderboard from Redis
-        top_scores_data = leaderboard_manager.get_top_users(count=100)
-        
-        # 2. Get User Details (Username, First Name) from MySQL for the top users
-        user_ids = [entry['user_id'] for entry in top_scores_data] 
-        
-        # Retrieve necessary fields from the database in a single query (optimization)
-        user_details = CustomUser.objects.filter(id__in=user_ids).values(
-            'id', 'username', 'first_name'
-        )
-        
-        # Convert user_details to a dict for fast lookup using 'id'
-        user_details_map = {str(user['id']): user for user in user_details}
+        # Stringify the requesting user's id once; Redis members are already strings
+        user_id_str = str(request.user.id) if request.user.is_authenticated else None
+        # Optional per-level board; None/empty falls back to the global leaderboard
+        game_level = request.query_params.get('level') or None
 
-        # 3. Merge Redis Data with MySQL Details
-        leaderboard_list = []
-        for entry in top_scores_data:
-            user_id_str = str(entry['user_id'])
-            details = user_details_map.get(user_id_str, {})
-            
-            # Create the final, merged entry
-            leaderboard_list.append({
-                'rank': entry['rank'],
-                'user_id': user_id_str,
-                'score': entry['score'],
-                'username': details.get('username', 'Unknown User'),
-                'first_name': details.get('first_name', ''),
-            })
+        # 0. The top 100 list is identical for every viewer, so it is cached
+        # (already serialized) in Redis for a few seconds
+        cached_leaderboard = leaderboard_manager.get_cached_top_users_json(game_level)
 
-        # 4. Serialize the final list
-        leaderboard_serializer = LeaderboardEntrySerializer(leaderboard_list, many=True)
-
-        # 5. Get the requesting user's rank/score (from Redis)
+        # 1. Get Top 100 Leaderboard from Redis. Entries come back as plain dicts in their
+        # final shape (names from the profiles hash), so no DRF serializer is run here.
+        # For authenticated users the top list and the user's own rank/score
+        # are fetched together in a single Redis call (Lua script)
         user_rank_data = None
-        if request.user.is_authenticated:
-            user_rank_data = leaderboard_manager.get_user_rank_and_score(str(request.user.id))
-            
-            if user_rank_data:
-                # Include username and first name for the current user's entry
-                user_rank_data['username'] = request.user.username
-                user_rank_data['first_name'] = request.user.first_name
+        if cached_leaderboard is not None:
+            # Cache hit: orjson.Fragment embeds the cached JSON as-is, without parsing it.
+            # Authenticated users only need their own slice on top.
+            leaderboard_data = orjson.Fragment(cached_leaderboard)
+            if user_id_str is not None:
+                user_rank_data = leaderboard_manager.get_user_rank_and_score(user_id_str, game_level=game_level)
+        else:
+            if user_id_str is not None:
+                leaderboard_data, user_rank_data = leaderboard_manager.get_leaderboard_bundle(
+                    user_id_str, count=100, game_level=game_level
+                )
+            else:
+                leaderboard_data = leaderboard_manager.get_top_users(count=100, game_level=game_level)
+
+            # 2. Cache the list for the next viewers. An empty list is not cached: it is
+            # also what the manager returns when Redis is unavailable, and an empty board
+            # is cheap to read again anyway
+            if leaderboard_data:
+                leaderboard_manager.cache_top_users_json(orjson.dumps(leaderboard_data), game_level)
+
+        # 3. Attach the requesting user's details to their rank/score (fetched in step 1)
+        if user_rank_data:
+            # Include username and first name for the current user's entry
+            user_rank_data['username'] = request.user.username
+            user_rank_data['first_name'] = request.user.first_name
         
-        # 6. Construct the final response
+        # 4. Construct the final response
         response_data = {
-            'global_leaderboard': leaderboard_serializer.data,
+            'global_leaderboard': leaderboard_data,
             'current_user_rank': user_rank_data,
         }
 
-        return Response(response_data, status=status.HTTP_200_OK)
\ No newline at end of file
+        # The payload is plain primitives, so it is rendered with orjson directly
+        # instead of going through DRF's content negotiation and renderers
+        return HttpResponse(orjson.dumps(response_data), content_type='application/json')
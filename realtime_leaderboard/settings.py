@@ -163,6 +163,11 @@ REDIS_DB = 0 # Database 0 will be for the leaderboard (Sorted Set)
 
 REDIS_URL = f"redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}"
 
+# If True, committed score submissions are pushed onto a Redis list and applied to the
+# leaderboards by a separate worker (`python manage.py process_leaderboard_updates`).
+# If False, they are applied to the leaderboards right after the transaction commits.
+LEADERBOARD_ASYNC_UPDATES = False
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 